@@ -8,34 +8,48 @@
 
 from typing import Any, Dict, List, Optional, Tuple, Union
 
+import pandas as pd
 from snowflake.connector import SnowflakeConnection
-from snowflake_db import execute, execute_many, fetch_all, fetch_one_value
+from snowflake_db import (
+    execute,
+    execute_many,
+    execute_returning,
+    fetch_all,
+    fetch_one,
+    fetch_one_value,
+    fetch_pandas,
+)
 
 
 # team stuff
 
 def add_team(con: SnowflakeConnection, team_name: str, members: str, budget: float) -> int:
     # add new team.
-    # need connection team name members and starting money.
-    # returns how many rows changed.
+    # need connection team name comma separated members and starting money.
+    # members are stored as an array. returns how many rows changed.
     sql = """
         INSERT INTO BOOTCAMP_RALLY.TEAMS.TEAMS
             (TEAM_NAME, MEMBERS, BUDGET)
-        VALUES (%s, %s, %s)
+        SELECT ?, STRTOK_TO_ARRAY(?, ','), ?
     """
+    # tidy spaces around names so array items are clean
+    members = ",".join(m.strip() for m in members.split(",") if m.strip())
     return execute(con, sql, (team_name, members, budget))
 
 
-def get_all_teams(con: SnowflakeConnection) -> List[Dict[str, Any]]:
-    # get all teams.
-    # need a connection.
+def get_all_teams(
+    con: SnowflakeConnection, limit: Optional[int] = None, offset: int = 0
+) -> List[Dict[str, Any]]:
+    # get all teams or one page of them.
+    # need a connection. no limit means every team.
     # returns list of team data.
     sql = """
         SELECT TEAM_ID, TEAM_NAME, MEMBERS, BUDGET
         FROM BOOTCAMP_RALLY.TEAMS.TEAMS
         ORDER BY TEAM_ID
+        LIMIT ? OFFSET ?
     """
-    return fetch_all(con, sql)
+    return fetch_all(con, sql, (limit, offset))
 
 
 def get_team_by_name(con: SnowflakeConnection, team_name: str) -> Optional[Dict[str, Any]]:
@@ -45,10 +59,9 @@ def get_team_by_name(con: SnowflakeConnection, team_name: str) -> Optional[Dict[
     sql = """
         SELECT TEAM_ID, TEAM_NAME, MEMBERS, BUDGET
         FROM BOOTCAMP_RALLY.TEAMS.TEAMS
-        WHERE TEAM_NAME = %s
+        WHERE TEAM_NAME = ?
     """
-    rows = fetch_all(con, sql, (team_name,))
-    return rows[0] if rows else None
+    return fetch_one(con, sql, (team_name,))
 
 
 def update_team_budget_delta(con: SnowflakeConnection, team_id: int, delta: float) -> int:
@@ -57,8 +70,8 @@ def update_team_budget_delta(con: SnowflakeConnection, team_id: int, delta: floa
     # returns number of teams updated.
     sql = """
         UPDATE BOOTCAMP_RALLY.TEAMS.TEAMS
-        SET BUDGET = BUDGET + %s
-        WHERE TEAM_ID = %s
+        SET BUDGET = BUDGET + ?
+        WHERE TEAM_ID = ?
     """
     return execute(con, sql, (delta, team_id))
 
@@ -70,7 +83,7 @@ def get_team_budget(con: SnowflakeConnection, team_id: int) -> Optional[float]:
     sql = """
         SELECT BUDGET
         FROM BOOTCAMP_RALLY.TEAMS.TEAMS
-        WHERE TEAM_ID = %s
+        WHERE TEAM_ID = ?
     """
     val = fetch_one_value(con, sql, (team_id,))
     return float(val) if val is not None else None
@@ -92,62 +105,117 @@ def add_car(
     sql = """
         INSERT INTO BOOTCAMP_RALLY.CARS.CARS
             (CAR_NAME, TEAM_ID, SPEED, DURABILITY, ACCELERATION)
-        VALUES (%s, %s, %s, %s, %s)
+        VALUES (?, ?, ?, ?, ?)
     """
     return execute(con, sql, (car_name, team_id, speed, durability, acceleration))
 
 
-def get_all_cars(con: SnowflakeConnection) -> List[Dict[str, Any]]:
-    # get all cars and their team info.
-    # need connection.
+_ALL_CARS_SQL = """
+    SELECT
+        c.CAR_ID,
+        c.CAR_NAME,
+        c.TEAM_ID,
+        t.TEAM_NAME,
+        c.SPEED,
+        c.DURABILITY,
+        c.ACCELERATION
+    FROM BOOTCAMP_RALLY.CARS.CARS c
+    LEFT JOIN BOOTCAMP_RALLY.TEAMS.TEAMS t
+        ON c.TEAM_ID = t.TEAM_ID
+    ORDER BY c.CAR_ID
+    LIMIT ? OFFSET ?
+"""
+
+
+def get_all_cars(
+    con: SnowflakeConnection, limit: Optional[int] = None, offset: int = 0
+) -> List[Dict[str, Any]]:
+    # get all cars and their team info, or one page of them.
+    # need connection. no limit means every car.
     # returns list of car data.
-    sql = """
-        SELECT
-            c.CAR_ID,
-            c.CAR_NAME,
-            c.TEAM_ID,
-            t.TEAM_NAME,
-            c.SPEED,
-            c.DURABILITY,
-            c.ACCELERATION
-        FROM BOOTCAMP_RALLY.CARS.CARS c
-        LEFT JOIN BOOTCAMP_RALLY.TEAMS.TEAMS t
-            ON c.TEAM_ID = t.TEAM_ID
-        ORDER BY c.CAR_ID
-    """
-    return fetch_all(con, sql)
+    return fetch_all(con, _ALL_CARS_SQL, (limit, offset))
+
+
+def get_all_cars_df(
+    con: SnowflakeConnection, limit: Optional[int] = None, offset: int = 0
+) -> pd.DataFrame:
+    # get all cars and their team info as dataframe, or one page of them.
+    # uses arrow fetch so no dicts in between.
+    # returns car data frame.
+    return fetch_pandas(con, _ALL_CARS_SQL, (limit, offset))
 
 
 # race stuff
 
+# race statements below take the race id as {race_id}.
+# single calls bind it with ?, record_race uses the $NEW_RACE_ID session variable.
+
+# take id from the sequence first so no other race can be read back.
+# session variable is private to this connection while it is borrowed.
+_NEW_RACE_ID_SQL = "SET NEW_RACE_ID = (SELECT BOOTCAMP_RALLY.RACES.RACE_ID_SEQ.NEXTVAL)"
+
+_INSERT_NEW_RACE_SQL = """
+    INSERT INTO BOOTCAMP_RALLY.RACES.RACES
+        (RACE_ID, TRACK_NAME)
+    SELECT $NEW_RACE_ID, ?
+"""
+
+_READ_NEW_RACE_ID_SQL = "SELECT $NEW_RACE_ID"
+
+
 def create_race(con: SnowflakeConnection, track_name: str) -> Optional[int]:
     # make a new race.
     # need track name.
     # returns race id or none if failed.
-    sql = """
-        INSERT INTO BOOTCAMP_RALLY.RACES.RACES
-            (TRACK_NAME)
-        VALUES (%s)
-    """
-    execute(con, sql, (track_name,))
-    # get race id i made
-    race_id = fetch_one_value(
+    race_id = execute_returning(
         con,
-        "SELECT MAX(RACE_ID) FROM BOOTCAMP_RALLY.RACES.RACES"
+        [_NEW_RACE_ID_SQL, _INSERT_NEW_RACE_SQL, _READ_NEW_RACE_ID_SQL],
+        [None, (track_name,), None],
     )
     return int(race_id) if race_id is not None else None
 
 
-def set_race_winner(con: SnowflakeConnection, race_id: int, winner_team_id: int) -> int:
+_SET_RACE_WINNER_SQL = """
+    UPDATE BOOTCAMP_RALLY.RACES.RACES
+    SET WINNER_TEAM_ID = (
+        SELECT c.TEAM_ID
+        FROM BOOTCAMP_RALLY.RACES.RACE_RESULTS rr
+        JOIN BOOTCAMP_RALLY.CARS.CARS c
+            ON c.CAR_ID = rr.CAR_ID
+        WHERE rr.RACE_ID = {race_id}
+          AND rr.POSITION = 1
+    )
+    WHERE RACE_ID = {race_id}
+"""
+
+_RUN_RACE_SQL = """
+    INSERT INTO BOOTCAMP_RALLY.RACES.RACE_RESULTS
+        (RACE_ID, CAR_ID, TIME_TAKEN, POSITION)
+    SELECT {race_id},
+           sim.CAR_ID,
+           sim.TIME_MIN,
+           ROW_NUMBER() OVER (ORDER BY sim.TIME_MIN, sim.CAR_ID)
+    FROM (
+        SELECT c.CAR_ID,
+               ROUND(60.0 * ? / GREATEST(
+                   50.0,
+                   c.SPEED
+                   * (0.5 + 0.5 * LEAST(1, GREATEST(0, c.DURABILITY)))
+                   * (0.5 + 0.5 * LEAST(1, GREATEST(0, c.ACCELERATION)))
+                   * UNIFORM(0.95::FLOAT, 1.05::FLOAT, RANDOM())
+                   * ?
+               ), 3) AS TIME_MIN
+        FROM BOOTCAMP_RALLY.CARS.CARS c
+    ) sim
+"""
+
+
+def set_race_winner(con: SnowflakeConnection, race_id: int) -> int:
     # mark which team won a race.
-    # need race id and winner team id.
+    # need race id. winner is the team of the position 1 car.
     # returns number of races updated.
-    sql = """
-        UPDATE BOOTCAMP_RALLY.RACES.RACES
-        SET WINNER_TEAM_ID = %s
-        WHERE RACE_ID = %s
-    """
-    return execute(con, sql, (winner_team_id, race_id))
+    sql = _SET_RACE_WINNER_SQL.format(race_id="?")
+    return execute(con, sql, (race_id, race_id))
 
 
 def insert_race_results(
@@ -161,65 +229,158 @@ def insert_race_results(
     sql = """
         INSERT INTO BOOTCAMP_RALLY.RACES.RACE_RESULTS
             (RACE_ID, CAR_ID, TIME_TAKEN, POSITION)
-        VALUES (%s, %s, %s, %s)
+        VALUES (?, ?, ?, ?)
     """
-    # make list
-    params = []
-    for (car_id, time_taken, position) in results:
-        params.append((race_id, car_id, time_taken, position))
-    
+    params = [(race_id, car_id, time_taken, position) for (car_id, time_taken, position) in results]
     return execute_many(con, sql, params)
 
 
+def run_race_on_server(
+    con: SnowflakeConnection,
+    race_id: int,
+    track_factor: float,
+    distance_km: float = 100.0,
+) -> int:
+    # simulate race for all cars inside snowflake.
+    # times and positions are worked out and saved in one insert.
+    # returns how many result rows added.
+    sql = _RUN_RACE_SQL.format(race_id="?")
+    return execute(con, sql, (race_id, distance_km, track_factor))
+
+
+_RACE_RESULTS_SQL = """
+    SELECT rr.RESULT_ID,
+           rr.RACE_ID,
+           rr.CAR_ID,
+           c.CAR_NAME,
+           c.TEAM_ID,
+           t.TEAM_NAME,
+           rr.TIME_TAKEN,
+           rr.POSITION
+    FROM BOOTCAMP_RALLY.RACES.RACE_RESULTS rr
+    LEFT JOIN BOOTCAMP_RALLY.CARS.CARS c
+        ON rr.CAR_ID = c.CAR_ID
+    LEFT JOIN BOOTCAMP_RALLY.TEAMS.TEAMS t
+        ON c.TEAM_ID = t.TEAM_ID
+    WHERE rr.RACE_ID = ?
+    ORDER BY rr.POSITION ASC
+"""
+
+
 def get_race_results(con: SnowflakeConnection, race_id: int) -> List[Dict[str, Any]]:
     # get results for a specific race.
     # includes car and team details.
     # returns results sorted by position.
-    sql = """
-        SELECT rr.RESULT_ID,
-               rr.RACE_ID,
-               rr.CAR_ID,
-               c.CAR_NAME,
-               c.TEAM_ID,
-               t.TEAM_NAME,
-               rr.TIME_TAKEN,
-               rr.POSITION
-        FROM BOOTCAMP_RALLY.RACES.RACE_RESULTS rr
-        LEFT JOIN BOOTCAMP_RALLY.CARS.CARS c
-            ON rr.CAR_ID = c.CAR_ID
-        LEFT JOIN BOOTCAMP_RALLY.TEAMS.TEAMS t
-            ON c.TEAM_ID = t.TEAM_ID
-        WHERE rr.RACE_ID = %s
-        ORDER BY rr.POSITION ASC
-    """
-    return fetch_all(con, sql, (race_id,))
+    return fetch_all(con, _RACE_RESULTS_SQL, (race_id,))
+
+
+def get_race_results_df(con: SnowflakeConnection, race_id: int) -> pd.DataFrame:
+    # get results for a specific race as dataframe.
+    # uses arrow fetch so no dicts in between.
+    # returns results sorted by position.
+    return fetch_pandas(con, _RACE_RESULTS_SQL, (race_id,))
+
+
+def record_race(
+    con: SnowflakeConnection,
+    track_name: str,
+    track_factor: float,
+    fee: float,
+    prize: float,
+    distance_km: float = 100.0,
+) -> Optional[int]:
+    # create, run and save whole race in one all or nothing request.
+    # race row, results, winner, fees and prize all go together.
+    # fee is charged to teams of the cars that raced.
+    # times and winner are worked out on the server.
+    # returns new race id or none if failed.
+    new_id = "$NEW_RACE_ID"
+    sqls = [
+        _NEW_RACE_ID_SQL,
+        _INSERT_NEW_RACE_SQL,
+        _RUN_RACE_SQL.format(race_id=new_id),
+        _SET_RACE_WINNER_SQL.format(race_id=new_id),
+        _PAY_RACE_FEE_SQL.format(race_id=new_id),
+        _CREDIT_WINNER_PRIZE_SQL.format(race_id=new_id),
+        _READ_NEW_RACE_ID_SQL,
+    ]
+    params_list = [
+        None,
+        (track_name,),
+        (distance_km, track_factor),
+        None,
+        (fee,),
+        (prize,),
+        None,
+    ]
+    race_id = execute_returning(con, sqls, params_list)
+    return int(race_id) if race_id is not None else None
 
 
 # money stuff
 
+_PAY_RACE_FEE_SQL = """
+    UPDATE BOOTCAMP_RALLY.TEAMS.TEAMS
+    SET BUDGET = BUDGET - ?
+    WHERE TEAM_ID IN (
+        SELECT c.TEAM_ID
+        FROM BOOTCAMP_RALLY.RACES.RACE_RESULTS rr
+        JOIN BOOTCAMP_RALLY.CARS.CARS c
+            ON c.CAR_ID = rr.CAR_ID
+        WHERE rr.RACE_ID = {race_id}
+    )
+"""
+
+_CREDIT_WINNER_PRIZE_SQL = """
+    UPDATE BOOTCAMP_RALLY.TEAMS.TEAMS
+    SET BUDGET = BUDGET + ?
+    WHERE TEAM_ID = (
+        SELECT WINNER_TEAM_ID
+        FROM BOOTCAMP_RALLY.RACES.RACES
+        WHERE RACE_ID = {race_id}
+    )
+"""
+
+
 def pay_participation_fee_for_all_teams_with_cars(con: SnowflakeConnection, fee: float) -> int:
     # make teams pay for joining race.
     # takes money from all teams with cars.
     # returns how many teams paid.
     sql = """
         UPDATE BOOTCAMP_RALLY.TEAMS.TEAMS t
-        SET t.BUDGET = t.BUDGET - %s
-        WHERE t.TEAM_ID IN (
-            SELECT DISTINCT TEAM_ID
-            FROM BOOTCAMP_RALLY.CARS.CARS
-            WHERE TEAM_ID IS NOT NULL
+        SET t.BUDGET = t.BUDGET - ?
+        WHERE EXISTS (
+            SELECT 1
+            FROM BOOTCAMP_RALLY.CARS.CARS c
+            WHERE c.TEAM_ID = t.TEAM_ID
         )
     """
     return execute(con, sql, (fee,))
 
 
-def credit_winner_prize(con: SnowflakeConnection, winner_team_id: int, prize: float) -> int:
-    # give prize money to winner.
-    # adds cash to winning team budget.
-    # returns how many teams got paid.
-    sql = """
+def _pay_fee_sql(team_count: int) -> str:
+    # build fee update for a fixed number of teams.
+    # one ? per team id after the fee.
+    placeholders = ", ".join(["?"] * team_count)
+    return f"""
         UPDATE BOOTCAMP_RALLY.TEAMS.TEAMS
-        SET BUDGET = BUDGET + %s
-        WHERE TEAM_ID = %s
+        SET BUDGET = BUDGET - ?
+        WHERE TEAM_ID IN ({placeholders})
     """
-    return execute(con, sql, (prize, winner_team_id))
\ No newline at end of file
+
+
+def pay_fee(con: SnowflakeConnection, fee: float, team_ids: List[int]) -> int:
+    # make given teams pay for joining race.
+    # need fee and ids of teams taking part.
+    # returns how many teams paid.
+    if not team_ids:
+        return 0
+    return execute(con, _pay_fee_sql(len(team_ids)), (fee, *team_ids))
+
+
+def credit_winner_prize(con: SnowflakeConnection, race_id: int, prize: float) -> int:
+    # give prize money to winner.
+    # adds cash to the team set as winner of the race.
+    # returns how many teams got paid.
+    sql = _CREDIT_WINNER_PRIZE_SQL.format(race_id="?")
+    return execute(con, sql, (prize, race_id))
\ No newline at end of file
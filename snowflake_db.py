@@ -2,8 +2,13 @@
 # connect to snowflake and run queries. handles transactions too.
 
 import os
-from typing import Any, Dict, List, Optional, Tuple, Union
+import queue
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, FrozenSet, Iterator, List, Optional, Tuple, Union
 
+import pandas as pd
 import snowflake.connector as sf
 from dotenv import load_dotenv
 from snowflake.connector import SnowflakeConnection
@@ -11,8 +16,29 @@ from snowflake.connector import SnowflakeConnection
 # load environment
 load_dotenv()
 
-# transaction flag
-IN_TRANSACTION = False
+# bind params on the server with ? placeholders.
+# lets executemany use array binding instead of one huge insert string.
+sf.paramstyle = "qmark"
+
+# ids of connections with an open transaction.
+# one set per thread/task so sessions dont share it
+_IN_TX: ContextVar[FrozenSet[int]] = ContextVar("in_tx", default=frozenset())
+
+# connection pool settings
+POOL_SIZE = 4
+POOL_TIMEOUT = 120  # seconds to wait for a free connection
+
+# errors about one statement. session is still fine after these
+_STATEMENT_ERRORS = (
+    sf.errors.ProgrammingError,
+    sf.errors.IntegrityError,
+    sf.errors.DataError,
+)
+
+# idle connections. opened lazily up to POOL_SIZE
+_pool: "queue.LifoQueue[SnowflakeConnection]" = queue.LifoQueue(maxsize=POOL_SIZE)
+_pool_lock = threading.Lock()
+_pool_opened = 0
 
 
 def _require_env(name: str) -> str:
@@ -36,24 +62,97 @@ def get_connection() -> SnowflakeConnection:
         warehouse=_require_env("SNOWFLAKE_WAREHOUSE"),
         role=_require_env("SNOWFLAKE_ROLE"),
         database=os.getenv("SNOWFLAKE_DATABASE", "BOOTCAMP_RALLY"),
-        autocommit=False,  # be explicit; we manage commits below
+        autocommit=True,  # server commits single writes; Transaction uses BEGIN
         client_session_keep_alive=True,  # helpful for Streamlit
+        # TRUE is already the default. pinned so an account or user level
+        # override cant turn the result cache off for this app.
+        session_parameters={"USE_CACHED_RESULT": True},
     )
     return conn
 
 
+def _open_pooled() -> SnowflakeConnection:
+    # open a new connection for the pool.
+    # keeps count right if connecting fails.
+    global _pool_opened
+    try:
+        return get_connection()
+    except Exception:
+        with _pool_lock:
+            _pool_opened -= 1
+        raise
+
+
+def _take_conn() -> SnowflakeConnection:
+    # get an idle connection or open one if pool not full.
+    # waits for one to come back otherwise.
+    global _pool_opened
+    try:
+        conn = _pool.get_nowait()
+    except queue.Empty:
+        with _pool_lock:
+            can_open = _pool_opened < POOL_SIZE
+            if can_open:
+                _pool_opened += 1
+        if can_open:
+            return _open_pooled()
+        try:
+            conn = _pool.get(timeout=POOL_TIMEOUT)
+        except queue.Empty:
+            raise TimeoutError(
+                f"No Snowflake connection free after {POOL_TIMEOUT} seconds"
+            ) from None
+    # keep alive is on so closed is the only dead state worth checking
+    if conn.is_closed():
+        return _open_pooled()
+    return conn
+
+
+def _give_back(conn: SnowflakeConnection) -> None:
+    # put connection back in the pool.
+    # drops it instead if it got closed while borrowed.
+    global _pool_opened
+    if conn.is_closed():
+        with _pool_lock:
+            _pool_opened -= 1
+        return
+    _pool.put_nowait(conn)
+
+
+@contextmanager
+def borrow_conn() -> Iterator[SnowflakeConnection]:
+    # borrow a pooled connection for a with block.
+    # gives it back when the block ends, even on errors.
+    # drops it if a connection or session error means it may be dead.
+    # yields an active connection.
+    conn = _take_conn()
+    try:
+        yield conn
+    except sf.errors.DatabaseError as e:
+        # 390xxx codes are login/session errors like an expired token
+        session_error = 390000 <= (e.errno or 0) < 391000
+        if session_error or not isinstance(e, _STATEMENT_ERRORS):
+            # closed connections are not put back, so the slot frees up
+            try:
+                conn.close()
+            except Exception:
+                pass
+        raise
+    finally:
+        _give_back(conn)
+
+
+def _in_transaction(conn: SnowflakeConnection) -> bool:
+    # check if this connection has a transaction open.
+    return id(conn) in _IN_TX.get()
+
+
 def _rows_to_dicts(cursor, rows) -> List[Dict[str, Any]]:
     # turn database rows into dicts.
     # makes data easier to work with.
     # returns list of dicts with column names as keys.
     col_names = [info[0] for info in cursor.description]
-    result = []
-    for row in rows:
-        item = {}
-        for i in range(len(col_names)):
-            item[col_names[i]] = row[i]
-        result.append(item)
-    return result
+    return [dict(zip(col_names, row)) for row in rows]
 
 
 def fetch_all(
@@ -68,6 +167,17 @@ def fetch_all(
         return _rows_to_dicts(cur, rows)
 
 
+def fetch_pandas(
+    conn: SnowflakeConnection, sql: str, params: Optional[Tuple] = None
+) -> pd.DataFrame:
+    # run a select query and get results as dataframe.
+    # uses the connector arrow path, skips building python rows.
+    # returns dataframe with all rows.
+    with conn.cursor() as cur:
+        cur.execute(sql, params or ())
+        return cur.fetch_pandas_all()
+
+
 def fetch_one(
     conn: SnowflakeConnection, sql: str, params: Optional[Tuple] = None
 ) -> Optional[Dict[str, Any]]:
@@ -77,9 +187,10 @@ def fetch_one(
     with conn.cursor() as cur:
         cur.execute(sql, params or ())
         row = cur.fetchone()
-        if row:
-            return _rows_to_dicts(cur, [row])[0]
-        return None
+        if row is None:
+            return None
+        col_names = [info[0] for info in cur.description]
+        return dict(zip(col_names, row))
 
 
 def fetch_one_value(
@@ -104,11 +215,66 @@ def execute(
     # returns how many rows changed.
     with conn.cursor() as cur:
         cur.execute(sql, params or ())
-        if not IN_TRANSACTION:
-            conn.commit()
         return cur.rowcount
 
 
+def execute_returning(
+    conn: SnowflakeConnection, sqls: List[str], params_list: List[Optional[Tuple]]
+) -> Any:
+    # run writes and read something back in one request.
+    # snowflake has no RETURNING so all go as one multi statement call.
+    # outside a transaction the writes get BEGIN/COMMIT in the same request.
+    # last statement is the read back. returns its first value or none.
+    statements = [sql.strip().rstrip(";") for sql in sqls]
+    wrapped = not _in_transaction(conn)
+    if wrapped:
+        statements = ["BEGIN", *statements[:-1], "COMMIT", statements[-1]]
+    script = ";\n".join(statements)
+    flat_params = tuple(p for params in params_list for p in (params or ()))
+    try:
+        with conn.cursor() as cur:
+            cur.execute(script, flat_params, num_statements=len(statements))
+            # walk every result so errors in earlier statements show up
+            for _ in range(len(statements) - 1):
+                cur.nextset()
+            row = cur.fetchone()
+    except Exception:
+        if wrapped:
+            conn.rollback()
+        raise
+    if row:
+        return row[0]
+    return None
+
+
+def execute_script(
+    conn: SnowflakeConnection, sqls: List[str], params_list: List[Optional[Tuple]]
+) -> int:
+    # run several statements in one request.
+    # params_list has params for each statement in same order.
+    # outside a transaction it wraps them in BEGIN/COMMIT in the same request.
+    # rolls back if something fails. returns total rows affected.
+    statements = [sql.strip().rstrip(";") for sql in sqls]
+    wrapped = not _in_transaction(conn)
+    if wrapped:
+        statements = ["BEGIN", *statements, "COMMIT"]
+    script = ";\n".join(statements)
+    flat_params = tuple(p for params in params_list for p in (params or ()))
+    try:
+        with conn.cursor() as cur:
+            cur.execute(script, flat_params, num_statements=len(statements))
+            counts = [max(cur.rowcount or 0, 0)]
+            # walk every result so errors in later statements show up
+            while cur.nextset():
+                counts.append(max(cur.rowcount or 0, 0))
+    except Exception:
+        if wrapped:
+            conn.rollback()
+        raise
+    # dont count BEGIN and COMMIT
+    return sum(counts[1:-1] if wrapped else counts)
+
+
 def execute_many(
     conn: SnowflakeConnection, sql: str, many_params: List[Tuple]
 ) -> int:
@@ -117,8 +283,6 @@ def execute_many(
     # returns total rows affected.
     with conn.cursor() as cur:
         cur.executemany(sql, many_params or [])
-        if not IN_TRANSACTION:
-            conn.commit()
         return cur.rowcount
 
 
@@ -131,28 +295,31 @@ class Transaction:
         # start a transaction.
         # need a connection.
         self.conn = conn
-        self._prev = False
+        self._token = None
+        self._outer = False
 
     def __enter__(self) -> "Transaction":
         # start transaction mode.
-        # turns on transaction flag.
-        global IN_TRANSACTION
-        self._prev = IN_TRANSACTION
-        IN_TRANSACTION = True
+        # opens a transaction unless one is already open, turns on flag.
+        self._outer = not _in_transaction(self.conn)
+        if self._outer:
+            with self.conn.cursor() as cur:
+                cur.execute("BEGIN")
+        self._token = _IN_TX.set(_IN_TX.get() | {id(self.conn)})
         return self
 
     def __exit__(self, exc_type, exc, tb) -> bool:
         # end transaction.
         # commit if all good or rollback if errors.
-        # returns false to let exceptions through.
-        global IN_TRANSACTION
+        # only the outermost one commits. returns false to let exceptions through.
         try:
-            if exc_type is None:
-                self.conn.commit()
-            else:
-                self.conn.rollback()
+            if self._outer:
+                if exc_type is None:
+                    self.conn.commit()
+                else:
+                    self.conn.rollback()
         finally:
-            IN_TRANSACTION = self._prev
+            _IN_TX.reset(self._token)
         # Do not suppress exceptions
         return False
 
@@ -7,25 +7,23 @@
 
 from __future__ import annotations
 
-import random
-from typing import Dict, List, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Dict, List, Optional
 
 import pandas as pd
 import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 
 from rally_data_access import (
     add_car,
     add_team,
-    credit_winner_prize,
-    create_race,
-    get_all_cars,
+    get_all_cars_df,
     get_all_teams,
-    get_race_results,
-    insert_race_results,
-    pay_participation_fee_for_all_teams_with_cars,
-    set_race_winner,
+    get_race_results_df,
+    record_race,
 )
-from snowflake_db import get_connection, transaction
+from snowflake_db import borrow_conn
 
 
 # streamlit stuff
@@ -37,31 +35,45 @@ st.set_page_config(
 )
 
 
-# db connection for session
+# cache stuff
+# data_rev goes up after every write so cached frames get refetched.
 
-@st.cache_resource
-def _conn():
-    # get connection for the session.
-    # returns a snowflake connection.
-    return get_connection()
+st.session_state.setdefault("data_rev", 0)
+
+# rows per page on the teams and cars lists
+PAGE_SIZE = 200
+
+
+def _bump_data_rev() -> None:
+    # mark cached data as stale after a write.
+    # also clears shared cache so other sessions dont get old frames.
+    st.session_state.data_rev += 1
+    teams_df.clear()
+    cars_df.clear()
 
 
 # helper stuff
 
-def teams_df() -> pd.DataFrame:
-    # get all teams as dataframe.
+@st.cache_data(ttl=300, show_spinner=False)
+def teams_df(rev: int, limit: Optional[int] = None, offset: int = 0) -> pd.DataFrame:
+    # get all teams or one page of them as dataframe.
+    # rev is the data version so writes skip old cache.
     # returns teams or empty frame if none.
-    data = get_all_teams(_conn())
+    with borrow_conn() as conn:
+        data = get_all_teams(conn, limit, offset)
     if not data:
         return pd.DataFrame(columns=["TEAM_ID", "TEAM_NAME", "MEMBERS", "BUDGET"])
     return pd.DataFrame(data)
 
 
-def cars_df() -> pd.DataFrame:
-    # get all cars as dataframe.
+@st.cache_data(ttl=300, show_spinner=False)
+def cars_df(rev: int, limit: Optional[int] = None, offset: int = 0) -> pd.DataFrame:
+    # get all cars or one page of them as dataframe.
+    # rev is the data version so writes skip old cache.
     # returns cars or empty frame if none.
-    data = get_all_cars(_conn())
-    if not data:
+    with borrow_conn() as conn:
+        df = get_all_cars_df(conn, limit, offset)
+    if df.empty:
         return pd.DataFrame(
             columns=[
                 "CAR_ID",
@@ -73,37 +85,44 @@ def cars_df() -> pd.DataFrame:
                 "ACCELERATION",
             ]
         )
-    return pd.DataFrame(data)
-
-
-def simulate_time_minutes(
-    speed_kmh: float,
-    durability: float,
-    acceleration: float,
-    track_factor: float,
-    variability: Tuple[float, float] = (0.95, 1.05),
-    distance_km: float = 100.0,
-) -> float:
-    # figure out how long car takes to finish race.
-    # uses speed durability acceleration and track stuff.
-    # adds some random variation too.
-    # returns time in minutes.
-    # performance stuff
-    perf_d = 0.5 + 0.5 * max(0.0, min(1.0, durability))
-    perf_a = 0.5 + 0.5 * max(0.0, min(1.0, acceleration))
-    
-    # random stuff
-    rand = random.uniform(variability[0], variability[1])
-    
-    # speed calc
-    eff_speed = speed_kmh * perf_d * perf_a * rand * track_factor
-    
-    # no crazy times
-    eff_speed = max(50.0, eff_speed)
-    
-    # minutes calc
-    time_hours = distance_km / eff_speed
-    return round(time_hours * 60.0, 3)
+    return df
+
+
+def show_paged(fetch: Callable[..., pd.DataFrame], key: str) -> None:
+    # show a table one page at a time with a load more button.
+    # each page is cached on its own so load more only fetches the new one.
+    offset_key = f"{key}_offset"
+    st.session_state.setdefault(offset_key, 0)
+    rev = st.session_state.data_rev
+    pages = [
+        fetch(rev, PAGE_SIZE, offset)
+        for offset in range(0, st.session_state[offset_key] + PAGE_SIZE, PAGE_SIZE)
+    ]
+    st.dataframe(pd.concat(pages, ignore_index=True), use_container_width=True)
+    # a full last page means there may be more rows
+    if len(pages[-1]) == PAGE_SIZE and st.button("Load more", key=f"{key}_more"):
+        st.session_state[offset_key] += PAGE_SIZE
+        st.rerun()
+
+
+def race_results_df(race_id: int) -> pd.DataFrame:
+    # get results of one race as dataframe.
+    # returns results sorted by position.
+    with borrow_conn() as conn:
+        return get_race_results_df(conn, race_id)
+
+
+def fetch_concurrently(*fetchers: Callable[[], Any]) -> List[Any]:
+    # run independent fetches side by side, each on its own pooled connection.
+    # worker threads get the script context so st.cache_data works there.
+    # returns results in the same order as the fetchers.
+    with ThreadPoolExecutor(
+        max_workers=len(fetchers),
+        initializer=add_script_run_ctx,
+        initargs=(None, get_script_run_ctx()),
+    ) as ex:
+        futures = [ex.submit(fetch) for fetch in fetchers]
+        return [f.result() for f in futures]
 
 
 def build_track_catalog() -> Dict[str, Dict[str, float]]:
@@ -120,13 +139,13 @@ def build_track_catalog() -> Dict[str, Dict[str, float]]:
 def compute_budgets_map(df: pd.DataFrame) -> Dict[int, float]:
     # match team ids to their money.
     # takes team data and gives back id to budget map.
-    return {int(r["TEAM_ID"]): float(r["BUDGET"]) for _, r in df.iterrows()}
+    return dict(zip(df["TEAM_ID"].astype(int).tolist(), df["BUDGET"].astype(float).tolist()))
 
 
 def team_name_map(df: pd.DataFrame) -> Dict[int, str]:
     # match team ids to their names.
     # takes team data and gives back id to name map.
-    return {int(r["TEAM_ID"]): str(r["TEAM_NAME"]) for _, r in df.iterrows()}
+    return dict(zip(df["TEAM_ID"].astype(int).tolist(), df["TEAM_NAME"].astype(str).tolist()))
 
 
 # sidebar nav
@@ -161,14 +180,15 @@ if page == "Teams":
                 if not t_name.strip():
                     st.error("Team name is required.")
                 else:
-                    add_team(_conn(), t_name.strip(), t_members.strip(), float(t_budget))
+                    with borrow_conn() as conn:
+                        add_team(conn, t_name.strip(), t_members.strip(), float(t_budget))
+                    _bump_data_rev()
                     st.success(f"Team '{t_name}' added.")
                     st.rerun()
 
     with col_r:
         st.subheader("Teams")
-        df_t = teams_df()
-        st.dataframe(df_t, use_container_width=True)
+        show_paged(teams_df, "teams")
 
 
 # cars page
@@ -177,7 +197,7 @@ elif page == "Cars":
     st.header("Cars Management")
 
     col_l, col_r = st.columns([1, 1])
-    df_t = teams_df()
+    df_t = teams_df(st.session_state.data_rev)
 
     with col_l:
         st.subheader("Add new car")
@@ -185,8 +205,11 @@ elif page == "Cars":
             st.info("Create a team first.")
         else:
             # team display
-            team_display = [f'{r["TEAM_NAME"]} (ID {r["TEAM_ID"]})' for _, r in df_t.iterrows()]
-            team_ids = [int(r["TEAM_ID"]) for _, r in df_t.iterrows()]
+            team_ids = df_t["TEAM_ID"].astype(int).tolist()
+            team_display = [
+                f"{name} (ID {tid})"
+                for name, tid in zip(df_t["TEAM_NAME"].tolist(), team_ids)
+            ]
             
             # pick team
             idx = st.selectbox(
@@ -208,21 +231,22 @@ elif page == "Cars":
                 if not c_name.strip():
                     st.error("Car name is required.")
                 else:
-                    add_car(
-                        _conn(),
-                        c_name.strip(),
-                        int(team_ids[idx]),
-                        float(c_speed),
-                        float(c_dur),
-                        float(c_acc),
-                    )
+                    with borrow_conn() as conn:
+                        add_car(
+                            conn,
+                            c_name.strip(),
+                            int(team_ids[idx]),
+                            float(c_speed),
+                            float(c_dur),
+                            float(c_acc),
+                        )
+                    _bump_data_rev()
                     st.success(f"Car '{c_name}' added.")
                     st.rerun()
 
     with col_r:
         st.subheader("Cars")
-        df_c = cars_df()
-        st.dataframe(df_c, use_container_width=True)
+        show_paged(cars_df, "cars")
 
 
 # race page
@@ -246,9 +270,11 @@ else:
             )
         st.caption(f"Track info: {tracks[track_name]['desc']}")
 
-    # show cars
-    df_c = cars_df()
-    df_t = teams_df()
+    # show cars. fetch cars and teams at the same time
+    df_c, df_t = fetch_concurrently(
+        partial(cars_df, st.session_state.data_rev),
+        partial(teams_df, st.session_state.data_rev),
+    )
     st.subheader("Eligible cars")
     st.dataframe(df_c, use_container_width=True)
 
@@ -261,55 +287,29 @@ else:
         # budgets before
         budgets_before = compute_budgets_map(df_t)
         team_names = team_name_map(df_t)
-
-        # make race
-        conn = _conn()
-        race_id = create_race(conn, track_name=track_name)
         t_factor = float(tracks[track_name]["factor"])
 
-        # calc car times
-        rows = []
-        for _, row in df_c.iterrows():
-            time_min = simulate_time_minutes(
-                speed_kmh=float(row["SPEED"]),
-                durability=float(row["DURABILITY"]),
-                acceleration=float(row["ACCELERATION"]),
-                track_factor=t_factor,
-            )
-            rows.append(
-                {
-                    "CAR_ID": int(row["CAR_ID"]),
-                    "TEAM_ID": int(row["TEAM_ID"]),
-                    "CAR_NAME": str(row["CAR_NAME"]),
-                    "TEAM_NAME": str(row.get("TEAM_NAME", "")),
-                    "TIME_MIN": time_min,
-                }
+        # make race, run it on the server and save everything at once
+        with borrow_conn() as conn:
+            race_id = record_race(
+                conn,
+                track_name,
+                t_factor,
+                float(fee),
+                float(prize),
             )
+        _bump_data_rev()
+
+        # show results. fetch results and new budgets at the same time
+        df_rr, df_t_after = fetch_concurrently(
+            partial(race_results_df, int(race_id)),
+            partial(teams_df, st.session_state.data_rev),
+        )
+
+        # race done message. results come back sorted so first row won
+        winner_name = df_rr["TEAM_NAME"].iloc[0] if not df_rr.empty else None
+        st.success(f"Race {race_id} finished! Winner: {winner_name}")
 
-        # sort by time
-        rows_sorted = sorted(rows, key=lambda r: r["TIME_MIN"])
-        
-        # prep results
-        results_payload: List[Tuple[int, float, int]] = []
-        for pos, r in enumerate(rows_sorted, start=1):
-            results_payload.append((int(r["CAR_ID"]), float(r["TIME_MIN"]), int(pos)))
-
-        # who won
-        winner_team_id = int(rows_sorted[0]["TEAM_ID"])
-
-        # save everything at once
-        with transaction(conn):
-            insert_race_results(conn, int(race_id), results_payload)
-            set_race_winner(conn, int(race_id), winner_team_id)
-            pay_participation_fee_for_all_teams_with_cars(conn, float(fee))
-            credit_winner_prize(conn, winner_team_id, float(prize))
-
-        # race done message
-        st.success(f"Race {race_id} finished! Winner: {team_names.get(winner_team_id)}")
-
-        # show results
-        rr = get_race_results(conn, int(race_id))
-        df_rr = pd.DataFrame(rr)
         # sort properly
         if "POSITION" in df_rr.columns:
             df_rr = df_rr.sort_values("POSITION")
@@ -318,7 +318,6 @@ else:
         st.dataframe(df_rr, use_container_width=True)
 
         # budget changes
-        df_t_after = teams_df()
         budgets_after = compute_budgets_map(df_t_after)
 
         budget_rows = []